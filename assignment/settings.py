@@ -90,6 +90,21 @@ DATABASES = {
 }
 
 
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Summary caching needs one cache shared by all workers (its per-user version counter is
+# bumped by whichever worker handles the POST); without REDIS_URL Django's per-process
+# LocMemCache is used and logs.views skips summary caching.
+
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -134,4 +149,5 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # REST framework
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': ['rest_framework.renderers.JSONRenderer'],
+    'DATETIME_FORMAT': 'iso-8601',
 }
\ No newline at end of file
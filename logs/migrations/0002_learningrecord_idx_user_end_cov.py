@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-15 10:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logs', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='learningrecord',
+            index=models.Index(fields=['user_id', 'end_at'], include=('word_count', 'start_at'), name='idx_user_end_cov'),
+        ),
+        migrations.RemoveIndex(
+            model_name='learningrecord',
+            name='idx_user_end',
+        ),
+        migrations.AlterField(
+            model_name='learningrecord',
+            name='end_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
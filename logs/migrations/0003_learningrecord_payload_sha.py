@@ -0,0 +1,51 @@
+# Generated by Django 4.2.30 on 2026-10-15 11:05
+
+import datetime
+import hashlib
+
+from django.db import migrations, models
+
+
+def _payload_sha(word_count, start_at, end_at):
+    # Frozen copy of logs.services.payload_sha at the time of this migration.
+    canonical = "|".join((
+        str(word_count),
+        start_at.astimezone(datetime.timezone.utc).isoformat() if start_at is not None else "",
+        end_at.astimezone(datetime.timezone.utc).isoformat() if end_at is not None else "",
+    ))
+    return hashlib.blake2b(canonical.encode(), digest_size=16).digest()
+
+
+def backfill_payload_sha(apps, schema_editor):
+    LearningRecord = apps.get_model('logs', 'LearningRecord')
+    batch = []
+    qs = LearningRecord.objects.filter(payload_sha__isnull=True).only('word_count', 'start_at', 'end_at')
+    for obj in qs.iterator():
+        obj.payload_sha = _payload_sha(obj.word_count, obj.start_at, obj.end_at)
+        batch.append(obj)
+        if len(batch) >= 1000:
+            LearningRecord.objects.bulk_update(batch, ['payload_sha'])
+            batch = []
+    if batch:
+        LearningRecord.objects.bulk_update(batch, ['payload_sha'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logs', '0002_learningrecord_idx_user_end_cov'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='learningrecord',
+            name='payload_sha',
+            field=models.BinaryField(editable=False, max_length=16, null=True),
+        ),
+        migrations.RunPython(backfill_payload_sha, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='learningrecord',
+            name='payload_sha',
+            field=models.BinaryField(editable=False, max_length=16),
+        ),
+    ]
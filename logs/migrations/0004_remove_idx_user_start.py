@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-15 11:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logs', '0003_learningrecord_payload_sha'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='learningrecord',
+            name='idx_user_start',
+        ),
+        migrations.AlterField(
+            model_name='learningrecord',
+            name='start_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
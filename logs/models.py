@@ -1,13 +1,34 @@
+import datetime as dt
+
 from django.db import models
+from django.db.models import Case, DurationField, ExpressionWrapper, F, IntegerField, Value, When
+from django.db.models.functions import Cast, Extract, Floor
+from django.utils.functional import cached_property
+
+_ONE_MINUTE = dt.timedelta(minutes=1)
+
+
+class LearningRecordQuerySet(models.QuerySet):
+    def with_study_minutes(self):
+        """Annotate study_minutes in SQL so list endpoints read an integer instead of computing it per row."""
+        duration = ExpressionWrapper(F("end_at") - F("start_at"), output_field=DurationField())
+        return self.annotate(study_minutes=Case(
+            When(start_at__lte=F("end_at"), then=Cast(Floor(Extract(duration, "epoch") / 60), IntegerField())),
+            default=Value(0),
+            output_field=IntegerField(),
+        ))
+
 
 class LearningRecord(models.Model):
     user_id = models.CharField(max_length=64, db_index=True)        # User identifier
     idempotency_key = models.CharField(max_length=64)               # Idempotency key (unique per record)
     word_count = models.PositiveIntegerField()                      # Total words learned in the session
-    start_at = models.DateTimeField(null=True, blank=True, db_index=True)  # Session start time (optional)
-    end_at = models.DateTimeField(null=True, blank=True, db_index=True)    # Session end time (optional)
+    start_at = models.DateTimeField(null=True, blank=True)          # Session start time (optional)
+    end_at = models.DateTimeField(null=True, blank=True)            # Session end time (optional)
     created_at = models.DateTimeField(auto_now_add=True)            # Record creation time (server-side)
+    payload_sha = models.BinaryField(max_length=16, editable=False)  # blake2b-128 of the payload (idempotency replay check)
 
+    objects = LearningRecordQuerySet.as_manager()
 
     class Meta:
         constraints = [
@@ -15,7 +36,14 @@ class LearningRecord(models.Model):
                                      name="uq_user_idempotency"),
         ]
         indexes = [
-            models.Index(fields=["user_id", "end_at"], name="idx_user_end"),
-            models.Index(fields=["user_id", "start_at"], name="idx_user_start"),
+            # Covers the summary window scan (user_id, end_at range) so it can run as an index-only scan.
+            models.Index(fields=["user_id", "end_at"], include=["word_count", "start_at"],
+                         name="idx_user_end_cov"),
         ]
 
+    @cached_property
+    def study_minutes(self) -> int:
+        """Whole minutes from start_at to end_at (0 if either is missing); overridden by with_study_minutes()."""
+        if self.start_at and self.end_at:
+            return max(0, (self.end_at - self.start_at) // _ONE_MINUTE)
+        return 0
@@ -1,32 +1,11 @@
 # logs/serializers.py
-from django.utils import timezone
+import datetime as dt
+
 from rest_framework import serializers
 
 from .models import LearningRecord
 
 
-class AwareDateTimeField(serializers.DateTimeField):
-    """
-    Datetime field that ensures tz-aware UTC datetimes.
-    - Accepts ISO strings with/without timezone; if naive → assume UTC.
-    - Always outputs ISO in UTC (Z).
-    """
-    def to_internal_value(self, value):
-        dt = super().to_internal_value(value)
-        if dt is None:
-            return None
-        if timezone.is_naive(dt):
-            dt = timezone.make_aware(dt, timezone.utc)
-        return dt.astimezone(timezone.utc)
-
-    def to_representation(self, value):
-        if value is None:
-            return None
-        if timezone.is_naive(value):
-            value = timezone.make_aware(value, timezone.utc)
-        return super().to_representation(value.astimezone(timezone.utc))
-
-
 class LearningRecordCreateSerializer(serializers.ModelSerializer):
     """
     Serializer for creating a LearningRecord.
@@ -35,12 +14,14 @@ class LearningRecordCreateSerializer(serializers.ModelSerializer):
       - start_at / end_at are optional; if both provided, must satisfy start_at <= end_at.
       - word_count must be >= 0.
     """
-    # Allow idempotency_key in the body; if not provided, the view will read from the Header.
+    # Allow idempotency_key in the body; the Header takes precedence, and a blank body value
+    # just means "not provided" (the view rejects the request only if neither is set).
     idempotency_key = serializers.CharField(
-        required=False, allow_blank=False, max_length=64
+        required=False, allow_blank=True, max_length=64
     )
-    start_at = AwareDateTimeField(required=False, allow_null=True)
-    end_at = AwareDateTimeField(required=False, allow_null=True)
+    # Naive input is read as UTC; output is always ISO-8601 in UTC ("Z").
+    start_at = serializers.DateTimeField(default_timezone=dt.timezone.utc, required=False, allow_null=True)
+    end_at = serializers.DateTimeField(default_timezone=dt.timezone.utc, required=False, allow_null=True)
 
     class Meta:
         model = LearningRecord
@@ -51,6 +32,8 @@ class LearningRecordCreateSerializer(serializers.ModelSerializer):
             "start_at",
             "end_at",
         )
+        # (user_id, idempotency_key) uniqueness is enforced by the upsert (replays are not errors).
+        validators = []
 
     def validate_word_count(self, v: int):
         if v is None:
@@ -74,10 +57,10 @@ class LearningRecordSerializer(serializers.ModelSerializer):
     Note: the "cross-day -> 0 minutes" aggregation rule only affects
     GET /summary and does not affect the POST echo here.
     """
-    start_at = AwareDateTimeField(required=False, allow_null=True)
-    end_at = AwareDateTimeField(required=False, allow_null=True)
-    created_at = AwareDateTimeField(read_only=True)
-    study_minutes = serializers.SerializerMethodField()
+    start_at = serializers.DateTimeField(default_timezone=dt.timezone.utc, read_only=True)
+    end_at = serializers.DateTimeField(default_timezone=dt.timezone.utc, read_only=True)
+    created_at = serializers.DateTimeField(default_timezone=dt.timezone.utc, read_only=True)
+    study_minutes = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = LearningRecord
@@ -91,10 +74,5 @@ class LearningRecordSerializer(serializers.ModelSerializer):
             "created_at",
             "study_minutes",
         )
-        read_only_fields = ("id", "created_at")
-
-    def get_study_minutes(self, obj) -> int:
-        if obj.start_at and obj.end_at:
-            seconds = max(0, int((obj.end_at - obj.start_at).total_seconds()))
-            return seconds // 60
-        return 0
+        # Every field is read-only so DRF skips writable-field processing for this echo serializer.
+        read_only_fields = fields
@@ -2,22 +2,98 @@
 from __future__ import annotations
 
 import datetime as dt
-from typing import Dict, List
+import hashlib
+from functools import lru_cache
+from typing import Dict, Tuple
+from zoneinfo import ZoneInfo, available_timezones
 
-import pytz
+from django.db import connection
 from django.utils import timezone
 from django.utils.dateparse import parse_datetime
 
 from .models import LearningRecord
 
+GRANULARITIES = frozenset(("hour", "day", "month"))
+
+# Window totals and the number of non-empty buckets in one statement. Buckets are local
+# wall-clock timestamps (timestamp without time zone) in %(tz)s, keyed by the local bucket
+# of end_at; the bucket range is [floor(from), floor(to)) = [bounds.lo, bounds.hi).
+_TOTALS_SQL = f"""
+    WITH bounds AS (
+        SELECT date_trunc(%(gran)s, %(from)s AT TIME ZONE %(tz)s) AS lo,
+               date_trunc(%(gran)s, %(to)s AT TIME ZONE %(tz)s) AS hi
+    ),
+    agg AS (
+        SELECT date_trunc(%(gran)s, end_at AT TIME ZONE %(tz)s) AS bucket_start,
+               SUM(word_count) AS wc,
+               SUM(CASE
+                       WHEN start_at IS NOT NULL
+                        AND date_trunc('day', start_at AT TIME ZONE %(tz)s)
+                            = date_trunc('day', end_at AT TIME ZONE %(tz)s)
+                       THEN GREATEST(0, floor(EXTRACT(EPOCH FROM end_at - start_at) / 60))::integer
+                       ELSE 0
+                   END) AS mins
+        FROM {LearningRecord._meta.db_table}
+        WHERE user_id = %(user_id)s AND end_at >= %(from)s AND end_at < %(to)s
+        GROUP BY 1
+    )
+    SELECT COALESCE(SUM(agg.wc), 0),
+           COALESCE(SUM(agg.mins), 0),
+           COUNT(*) FILTER (WHERE agg.wc > 0 OR agg.mins > 0)
+    FROM agg, bounds
+    WHERE agg.bucket_start < bounds.hi
+"""
+
+# Model.from_db expects values in _meta.concrete_fields order, so RETURNING follows it.
+_RECORD_FIELDS = LearningRecord._meta.concrete_fields
+_RECORD_ATTNAMES = [f.attname for f in _RECORD_FIELDS]
+# Insert, or lock and return the existing row only if its payload digest matches. The
+# no-op DO UPDATE makes ON CONFLICT re-check the latest committed row version (no snapshot
+# miss under concurrency); xmax = 0 holds only for a freshly inserted tuple. No row back
+# means the key exists with a different payload.
+_UPSERT_SQL = f"""
+    INSERT INTO {LearningRecord._meta.db_table} AS r
+        (user_id, idempotency_key, word_count, start_at, end_at, created_at, payload_sha)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT ON CONSTRAINT uq_user_idempotency
+        DO UPDATE SET payload_sha = EXCLUDED.payload_sha
+        WHERE r.payload_sha = EXCLUDED.payload_sha
+    RETURNING {", ".join("r." + f.column for f in _RECORD_FIELDS)}, (r.xmax = 0)
+"""
+
+
+class IdempotencyConflict(Exception):
+    """The idempotency key was already used for a different payload."""
+
+
+@lru_cache(maxsize=64)
+def get_tz(name: str) -> ZoneInfo:
+    """Resolve an IANA timezone name once per process."""
+    return ZoneInfo(name)
+
+
+# IANA names known to the zoneinfo backend, keyed case-insensitively (PostgreSQL's AT TIME ZONE
+# and pytz both accept "utc" / "asia/tokyo"); looked up so bad input never reaches ZoneInfo().
+# A host's system zoneinfo also lists entries that are not location zones: localtime and
+# posixrules (host links, unknown to PostgreSQL) and Factory (placeholder); those are left out.
+_NON_IANA_TZS = frozenset(("localtime", "posixrules", "Factory"))
+_TZ_BY_LOWER = {name.lower(): name for name in available_timezones() - _NON_IANA_TZS}
+
+
+def canonical_tz(name: str) -> str | None:
+    """Canonical IANA spelling of a timezone name (any case), or None if unknown."""
+    return _TZ_BY_LOWER.get(name.lower())
+
 
 def _to_aware_utc(x: str | dt.datetime) -> dt.datetime:
     """Parse an ISO string or datetime into a tz-aware datetime in UTC."""
     if isinstance(x, str):
-        d = parse_datetime(x)
+        d = parse_datetime(x)  # tries datetime.fromisoformat before its regex
         if d is None:
             raise ValueError("from/to must be ISO-8601")
     elif isinstance(x, dt.datetime):
+        if x.tzinfo is dt.timezone.utc:
+            return x
         d = x
     else:
         raise TypeError("datetime must be str or datetime")
@@ -26,119 +102,112 @@ def _to_aware_utc(x: str | dt.datetime) -> dt.datetime:
     return d.astimezone(dt.timezone.utc)
 
 
-def _floor_local(d: dt.datetime, granularity: str, tz: dt.tzinfo) -> dt.datetime:
-    """Floor a datetime to the bucket start at the given granularity in the local timezone (return tz-aware local time)."""
-    ld = d.astimezone(tz)
-    if granularity == "hour":
-        return ld.replace(minute=0, second=0, microsecond=0)
-    if granularity == "day":
-        return ld.replace(hour=0, minute=0, second=0, microsecond=0)
-    if granularity == "month":
-        return ld.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    raise ValueError("granularity must be hour|day|month")
+def _window(
+    dt_from: str | dt.datetime, dt_to: str | dt.datetime, granularity: str, tz: str,
+) -> Tuple[ZoneInfo, dt.datetime, dt.datetime] | None:
+    """Validate granularity/tz and parse [from, to) to UTC; None if the window is empty."""
+    if granularity not in GRANULARITIES:
+        raise ValueError("granularity must be hour|day|month")
+    tzinfo = get_tz(tz)
+    f_utc = _to_aware_utc(dt_from)
+    t_utc = _to_aware_utc(dt_to)
+    if f_utc >= t_utc:
+        return None
+    return tzinfo, f_utc, t_utc
 
 
-def _step_local(d: dt.datetime, granularity: str, tz: dt.tzinfo) -> dt.datetime:
-    """Advance by one bucket in the local timezone."""
+def count_buckets(
+    dt_from: str | dt.datetime,
+    dt_to: str | dt.datetime,
+    *,
+    granularity: str,
+    tz: str,
+) -> int:
+    """
+    Number of local buckets in [from, to): [floor(from), floor(to)) stepped by one
+    granularity in wall-clock time (timestamp without time zone, as the SQL buckets are),
+    computed arithmetically instead of listing them.
+    """
+    window = _window(dt_from, dt_to, granularity, tz)
+    if window is None:
+        return 0
+    tzinfo, f_utc, t_utc = window
+
+    lo = f_utc.astimezone(tzinfo).replace(tzinfo=None)
+    hi = t_utc.astimezone(tzinfo).replace(tzinfo=None)
     if granularity == "hour":
-        return d + dt.timedelta(hours=1)
+        lo = lo.replace(minute=0, second=0, microsecond=0)
+        hi = hi.replace(minute=0, second=0, microsecond=0)
+        return (hi - lo) // dt.timedelta(hours=1)
     if granularity == "day":
-        return d + dt.timedelta(days=1)
-    if granularity == "month":
-        year = d.year + (1 if d.month == 12 else 0)
-        month = 1 if d.month == 12 else d.month + 1
-        return d.replace(year=year, month=month, day=1, hour=0, minute=0, second=0, microsecond=0)
-    raise ValueError("granularity must be hour|day|month")
-
-
-def _bucket_key_by_end_local(end_at_utc: dt.datetime, granularity: str, tz: dt.tzinfo) -> dt.datetime:
-    """Assign a record to a bucket using the local-time view of end_at (return tz-aware local bucket start)."""
-    return _floor_local(end_at_utc, granularity, tz)
-
+        return (hi.date() - lo.date()).days
+    return (hi.year - lo.year) * 12 + (hi.month - lo.month)
 
-def _same_local_day(a_utc: dt.datetime, b_utc: dt.datetime, tz: dt.tzinfo) -> bool:
-    """Check if two UTC datetimes fall on the same local calendar day (same Y-M-D in the given timezone)."""
-    la = a_utc.astimezone(tz)
-    lb = b_utc.astimezone(tz)
-    return (la.year, la.month, la.day) == (lb.year, lb.month, lb.day)
 
-
-def _iter_bucket_starts(
-    from_utc: dt.datetime, to_utc: dt.datetime, granularity: str, tz: dt.tzinfo
-) -> List[dt.datetime]:
-    """Generate the list of local bucket starts that cover [from, to) (tz-aware, local timezone, right-open interval)."""
-    start_local = _floor_local(from_utc, granularity, tz)
-    end_local = _floor_local(to_utc, granularity, tz)  # right-open upper bound
-    out: List[dt.datetime] = []
-    cur = start_local
-    while cur < end_local:
-        out.append(cur)
-        cur = _step_local(cur, granularity, tz)
-    return out
-
-
-def summarize_with_sma(  # keep the name for compatibility; SMA is no longer returned
+def summarize_totals(
     user_id: str,
     dt_from: str | dt.datetime,
     dt_to: str | dt.datetime,
     *,
     granularity: str,
     tz: str,
-) -> List[Dict]:
+) -> Dict:
     """
-    Aggregate a user's learning word counts and study minutes over [from, to)
-    at the specified granularity and timezone.
+    Aggregate a user's word counts and study minutes over [from, to) in one SQL statement.
 
     Rules:
       1) Word counts are assigned to buckets by the local-time end_at.
-      2) Study minutes are counted as (end - start) // 60 only when both ends exist
-         and fall on the same local calendar day; otherwise 0.
-      3) Return all buckets including empty ones to support strict means when include_empty=true.
-    """
-    if granularity not in ("hour", "day", "month"):
-        raise ValueError("granularity must be hour|day|month")
+      2) Study minutes are counted as (end - start) // 60 (at least 0) only when both ends
+         exist and fall on the same local calendar day; otherwise 0.
 
-    tzinfo = pytz.timezone(tz)
-    f_utc = _to_aware_utc(dt_from)
-    t_utc = _to_aware_utc(dt_to)
-    if f_utc >= t_utc:
-        return []
-
-    bucket_starts_local = _iter_bucket_starts(f_utc, t_utc, granularity, tzinfo)
-    idx: Dict[dt.datetime, int] = {bs: i for i, bs in enumerate(bucket_starts_local)}
-    wc = [0.0 for _ in bucket_starts_local]
-    mins = [0.0 for _ in bucket_starts_local]
-
-    qs = LearningRecord.objects.filter(
-        user_id=user_id,
-        end_at__gte=f_utc,
-        end_at__lt=t_utc,
-    ).only("word_count", "start_at", "end_at")
-
-    for rec in qs:
-        end_at = rec.end_at
-        if end_at is None:
-            continue
-
-        bucket_key = _bucket_key_by_end_local(end_at, granularity, tzinfo)
-        if bucket_key not in idx:
-            continue
-        bi = idx[bucket_key]
-
-        wc[bi] += float(rec.word_count or 0)
-
-        s = rec.start_at
-        if s is not None and _same_local_day(s, end_at, tzinfo):
-            seconds = max(0, int((end_at - s).total_seconds()))
-            mins[bi] += float(seconds // 60)
-        else:
-            mins[bi] += 0.0
-
-    out = []
-    for i, bs_local in enumerate(bucket_starts_local):
-        out.append({
-            "bucket_start": bs_local.isoformat(),  # local timezone ISO
-            "wc_sum": float(wc[i]),
-            "mins_sum": float(mins[i]),
+    Returns {"wc_sum", "mins_sum", "active_buckets"}, where active_buckets counts
+    buckets with word_count > 0 or study minutes > 0 (the include_empty=false denominator).
+    """
+    window = _window(dt_from, dt_to, granularity, tz)
+    if window is None:
+        return {"wc_sum": 0.0, "mins_sum": 0.0, "active_buckets": 0}
+    _, f_utc, t_utc = window
+
+    with connection.cursor() as cursor:
+        cursor.execute(_TOTALS_SQL, {
+            "user_id": user_id, "from": f_utc, "to": t_utc, "gran": granularity, "tz": tz,
         })
-    return out
+        wc, mins, active = cursor.fetchone()
+    return {"wc_sum": float(wc), "mins_sum": float(mins), "active_buckets": active}
+
+
+def payload_sha(word_count: int, start_at: dt.datetime | None, end_at: dt.datetime | None) -> bytes:
+    """Digest of the fields that make two submissions "the same payload" (datetimes in UTC)."""
+    canonical = "|".join((
+        str(word_count),
+        start_at.astimezone(dt.timezone.utc).isoformat() if start_at is not None else "",
+        end_at.astimezone(dt.timezone.utc).isoformat() if end_at is not None else "",
+    ))
+    return hashlib.blake2b(canonical.encode(), digest_size=16).digest()
+
+
+def upsert_record(
+    *,
+    user_id: str,
+    idempotency_key: str,
+    word_count: int,
+    start_at: dt.datetime | None,
+    end_at: dt.datetime | None,
+) -> Tuple[LearningRecord, bool]:
+    """
+    Insert a learning record unless (user_id, idempotency_key) already exists.
+
+    One INSERT ... ON CONFLICT DO UPDATE ... WHERE statement inserts the row or returns
+    the existing one when its payload digest matches, so creates, replays and conflicts
+    all cost one round trip and concurrent writers never hit IntegrityError.
+    Returns (record, created); replaying the same payload returns the stored record.
+    Raises IdempotencyConflict if the key was already used with a different payload.
+    """
+    sha = payload_sha(word_count, start_at, end_at)
+    with connection.cursor() as cursor:
+        cursor.execute(_UPSERT_SQL, [user_id, idempotency_key, word_count, start_at, end_at, timezone.now(), sha])
+        row = cursor.fetchone()
+    if row is None:
+        raise IdempotencyConflict("Idempotency-Key reused with different payload.")
+    *values, created = row
+    return LearningRecord.from_db(connection.alias, _RECORD_ATTNAMES, values), created
@@ -3,9 +3,33 @@ import datetime as dt
 from datetime import timedelta
 
 import pytest
+from django.core.cache import cache
+from django.db import connection
 from django.utils import timezone
 from rest_framework.test import APIClient
 
+from logs.models import LearningRecord
+from logs.services import count_buckets
+
+
+@pytest.fixture(autouse=True)
+def _clear_cache():
+    """The DB rolls back per test but LocMemCache does not; keep cached summaries from leaking."""
+    cache.clear()
+    yield
+    cache.clear()
+
+
+@pytest.fixture
+def shared_cache(settings, tmp_path):
+    """A cross-process cache backend, so the summary view caches (it skips LocMemCache)."""
+    settings.CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": str(tmp_path),
+        }
+    }
+
 
 def iso(dt_):
     """Ensure tz-aware UTC -> ISO string"""
@@ -60,6 +84,57 @@ def test_idempotent_conflict_same_key_different_payload_409():
     assert "Idempotency-Key reused" in r_conf.json().get("detail", "")
 
 
+@pytest.mark.django_db
+@pytest.mark.parametrize("overrides", [
+    {"word_count": -1},
+    {"word_count": "many"},
+    {"user_id": ""},
+    {"end_at": "not-a-date"},
+    {"start_at": "2025-01-02T00:00:00Z", "end_at": "2025-01-01T00:00:00Z"},
+])
+def test_create_invalid_payload_400(overrides):
+    c = APIClient()
+    payload = dict({
+        "user_id": "u-invalid",
+        "idempotency_key": "inv-1",
+        "word_count": 5,
+        "end_at": "2025-01-01T00:00:00Z",
+    }, **overrides)
+    assert c.post("/api/records", payload, format="json").status_code == 400
+
+
+@pytest.mark.django_db
+def test_create_header_key_wins_over_blank_body_key():
+    c = APIClient()
+    r = c.post("/api/records", {
+        "user_id": "u-hdr",
+        "idempotency_key": "",
+        "word_count": 5,
+        "end_at": "2025-01-01T00:00:00Z",
+    }, format="json", HTTP_IDEMPOTENCY_KEY="hdr-1")
+    assert r.status_code == 201
+    assert r.json()["idempotency_key"] == "hdr-1"
+
+
+@pytest.mark.django_db
+def test_idempotent_replay_same_instant_different_offset_200():
+    c = APIClient()
+    url = "/api/records"
+    payload = {
+        "user_id": "u-idem-tz",
+        "idempotency_key": "idem-tz",
+        "word_count": 7,
+        "end_at": "2025-10-27T10:00:00Z",
+    }
+    r1 = c.post(url, payload, format="json")
+    assert r1.status_code == 201
+
+    # Same instant written with a +09:00 offset is the same payload.
+    r2 = c.post(url, dict(payload, end_at="2025-10-27T19:00:00+09:00"), format="json")
+    assert r2.status_code == 200
+    assert r2.json()["id"] == r1.json()["id"]
+
+
 @pytest.mark.django_db
 def test_same_day_duration_minutes_is_difference_in_minutes():
     c = APIClient()
@@ -402,6 +477,92 @@ def test_random_within_one_month_hour_day_month_averages():
     assert dm["averages_per_bucket"]["study_minutes"] == total_min
 
 
+@pytest.mark.django_db
+@pytest.mark.usefixtures("shared_cache")
+def test_summary_reflects_records_added_after_a_cached_read():
+    c = APIClient()
+    uid = "u-cache"
+    _post_record(c, uid, "c-1", 10, timezone.datetime(2025, 6, 10, 9, 0, 0, tzinfo=dt.timezone.utc))
+
+    qs = (
+        f"/api/users/{uid}/summary?"
+        "from=2025-06-01T00:00:00Z&to=2025-07-01T00:00:00Z"
+        "&granularity=day&tz=UTC&include_empty=false"
+    )
+    assert c.get(qs).json()["totals"]["word_count"] == 10
+
+    # Backfilled record: earlier end_at than the latest one, still must show up.
+    _post_record(c, uid, "c-0", 5, timezone.datetime(2025, 6, 2, 9, 0, 0, tzinfo=dt.timezone.utc))
+    assert c.get(qs).json()["totals"]["word_count"] == 15
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("tz", ["Nope/Zone", "../etc/passwd", "", "localtime", "Factory"])
+def test_summary_invalid_tz_returns_400(tz):
+    c = APIClient()
+    _post_record(c, "u-tz", "tz-1", 10, timezone.datetime(2025, 10, 1, 9, 0, 0, tzinfo=dt.timezone.utc))
+    r = c.get(
+        "/api/users/u-tz/summary?"
+        f"from=2025-10-01T00:00:00Z&to=2025-10-02T00:00:00Z&granularity=day&tz={tz}"
+    )
+    assert r.status_code == 400
+    assert r.json()["detail"] == "invalid tz."
+
+
+# Reference listing of the summary buckets: local bucket starts in [floor(from), floor(to)),
+# stepped in wall-clock time by generate_series, the way the totals query groups them.
+_BUCKET_SPINE_COUNT_SQL = """
+    WITH bounds AS (
+        SELECT date_trunc(%(gran)s, %(from)s::timestamptz AT TIME ZONE %(tz)s) AS lo,
+               date_trunc(%(gran)s, %(to)s::timestamptz AT TIME ZONE %(tz)s) AS hi
+    )
+    SELECT count(*)
+    FROM bounds, generate_series(bounds.lo, bounds.hi, ('1 ' || %(gran)s)::interval) AS gs
+    WHERE gs < bounds.hi
+"""
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("gran", ["hour", "day", "month"])
+@pytest.mark.parametrize("tz", ["UTC", "America/New_York", "Asia/Kolkata"])
+@pytest.mark.parametrize("dt_from,dt_to", [
+    ("2025-03-08T12:34:00Z", "2025-03-10T05:00:00Z"),  # US spring-forward inside the window
+    ("2025-10-31T23:59:59Z", "2025-11-03T07:30:00Z"),  # US fall-back inside the window
+    ("2024-12-15T00:00:00Z", "2025-04-01T00:00:00Z"),
+    ("2025-06-01T10:15:00Z", "2025-06-01T10:45:00Z"),  # shorter than one bucket
+])
+def test_count_buckets_matches_bucket_listing(gran, tz, dt_from, dt_to):
+    with connection.cursor() as cursor:
+        cursor.execute(_BUCKET_SPINE_COUNT_SQL, {"from": dt_from, "to": dt_to, "gran": gran, "tz": tz})
+        (listed,) = cursor.fetchone()
+    assert count_buckets(dt_from, dt_to, granularity=gran, tz=tz) == listed
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("tz", ["utc", "asia/tokyo", "ASIA/TOKYO"])
+def test_summary_tz_name_is_case_insensitive(tz):
+    c = APIClient()
+    _post_record(c, "u-tz-case", "tc-1", 10, timezone.datetime(2025, 10, 1, 9, 0, 0, tzinfo=dt.timezone.utc))
+    r = c.get(
+        "/api/users/u-tz-case/summary?"
+        f"from=2025-10-01T00:00:00Z&to=2025-10-02T00:00:00Z&granularity=day&tz={tz}"
+    )
+    assert r.status_code == 200
+    assert r.json()["tz"] == tz
+    assert r.json()["totals"]["word_count"] == 10
+
+
+@pytest.mark.django_db
+def test_summary_invalid_from_returns_400():
+    c = APIClient()
+    _post_record(c, "u-bad-from", "bf-1", 10, timezone.datetime(2025, 10, 1, 9, 0, 0, tzinfo=dt.timezone.utc))
+    r = c.get(
+        "/api/users/u-bad-from/summary?"
+        "from=yesterday&to=2025-10-02T00:00:00Z&granularity=day&tz=UTC"
+    )
+    assert r.status_code == 400
+
+
 @pytest.mark.django_db
 def test_summary_user_not_found_returns_404():
     c = APIClient()
@@ -437,3 +598,97 @@ def test_summary_user_exists_but_no_data_in_window_returns_200_zeroes():
     assert data["totals"]["study_minutes"] == "study minutes less than a minute"
     assert data["averages_per_bucket"]["word_count"] == "word count less than 1"
     assert data["averages_per_bucket"]["study_minutes"] == "study minutes less than a minute"
+
+
+@pytest.mark.django_db
+def test_summary_user_whose_records_have_no_end_at_returns_200_zeroes():
+    c = APIClient()
+    r = c.post("/api/records", {
+        "user_id": "u-no-end",
+        "idempotency_key": "ne-1",
+        "word_count": 10,
+        "start_at": "2025-01-01T00:00:00Z",
+    }, format="json")
+    assert r.status_code == 201
+    assert r.json()["end_at"] is None
+
+    g = c.get(
+        "/api/users/u-no-end/summary?"
+        "from=2025-01-01T00:00:00Z&to=2025-01-02T00:00:00Z&granularity=day&tz=UTC"
+    )
+    assert g.status_code == 200
+    assert g.json()["totals"]["word_count"] == "word count less than 1"
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures("shared_cache")
+def test_summary_cache_echoes_each_callers_from_to_spelling():
+    c = APIClient()
+    _post_record(c, "u-spell", "sp-1", 10, timezone.datetime(2025, 1, 1, 3, 0, 0, tzinfo=dt.timezone.utc))
+    tail = "&to=2025-01-02T00:00:00Z&granularity=day&tz=UTC"
+
+    a = c.get("/api/users/u-spell/summary?from=2025-01-01T00:00:00Z" + tail).json()
+    b = c.get("/api/users/u-spell/summary?from=2025-01-01T09:00:00%2B09:00" + tail).json()
+    assert a["from"] == "2025-01-01T00:00:00Z"
+    assert b["from"] == "2025-01-01T09:00:00+09:00"
+    assert a["totals"] == b["totals"]
+
+
+@pytest.mark.django_db
+def test_with_study_minutes_annotation_matches_property():
+    t0 = timezone.datetime(2025, 3, 1, 23, 30, 0, tzinfo=dt.timezone.utc)
+    spans = [
+        (t0, t0 + timedelta(minutes=90, seconds=30)),
+        (t0, t0 + timedelta(seconds=59)),
+        (t0, t0 + timedelta(minutes=75)),  # crosses midnight
+        (t0 + timedelta(minutes=5), t0),  # start after end
+        (None, t0),
+        (t0, None),
+    ]
+    for i, (start_at, end_at) in enumerate(spans):
+        LearningRecord.objects.create(
+            user_id="u-annot", idempotency_key=f"an-{i}", word_count=1,
+            start_at=start_at, end_at=end_at, payload_sha=b"\0" * 16,
+        )
+
+    annotated = {r.idempotency_key: r.study_minutes for r in LearningRecord.objects.with_study_minutes()}
+    expected = {r.idempotency_key: r.study_minutes for r in LearningRecord.objects.all()}
+    assert annotated == expected
+    assert expected == {"an-0": 90, "an-1": 0, "an-2": 75, "an-3": 0, "an-4": 0, "an-5": 0}
+
+
+@pytest.mark.django_db
+def test_summary_not_cached_with_per_process_locmem_cache():
+    c = APIClient()
+    _post_record(c, "u-locmem", "lm-1", 10, timezone.datetime(2025, 6, 10, 9, 0, 0, tzinfo=dt.timezone.utc))
+    qs = (
+        "/api/users/u-locmem/summary?"
+        "from=2025-06-01T00:00:00Z&to=2025-07-01T00:00:00Z&granularity=day&tz=UTC"
+    )
+    assert c.get(qs).json()["totals"]["word_count"] == 10
+
+    # Written by "another worker": no version bump reaches this process, so nothing may be cached.
+    LearningRecord.objects.create(
+        user_id="u-locmem", idempotency_key="lm-2", word_count=5,
+        end_at=timezone.datetime(2025, 6, 11, 9, 0, 0, tzinfo=dt.timezone.utc), payload_sha=b"\0" * 16,
+    )
+    assert c.get(qs).json()["totals"]["word_count"] == 15
+
+
+@pytest.mark.django_db
+def test_summary_clamps_minutes_of_rows_with_start_after_end():
+    # The API rejects start_at > end_at, but rows written elsewhere must not subtract minutes.
+    end = timezone.datetime(2025, 5, 1, 10, 0, 0, tzinfo=dt.timezone.utc)
+    LearningRecord.objects.create(
+        user_id="u-neg", idempotency_key="neg-1", word_count=0,
+        start_at=end + timedelta(minutes=30), end_at=end, payload_sha=b"\0" * 16,
+    )
+    c = APIClient()
+    _post_record(c, "u-neg", "neg-2", 0, end - timedelta(minutes=20), minutes=20)
+
+    data = c.get(
+        "/api/users/u-neg/summary?"
+        "from=2025-05-01T00:00:00Z&to=2025-05-02T00:00:00Z&granularity=hour&tz=UTC&include_empty=false"
+    ).json()
+    assert data["totals"]["study_minutes"] == 20
+    assert data["averages_per_bucket"]["study_minutes"] == 20
@@ -2,141 +2,178 @@
 from __future__ import annotations
 
 import datetime as dt
-import pytz
+import hashlib
+import time
 
-from django.db import transaction, IntegrityError
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
 from django.utils import timezone
 from django.utils.dateparse import parse_datetime
+from django.utils.decorators import method_decorator
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from .models import LearningRecord
-from .services import summarize_with_sma
+from .serializers import LearningRecordCreateSerializer
+from .services import (
+    GRANULARITIES, IdempotencyConflict, canonical_tz, count_buckets, summarize_totals, upsert_record,
+)
+
+_UTC = dt.timezone.utc
+_ZERO = dt.timedelta(0)
 
 
 def _to_aware(dt_str: str | None) -> dt.datetime | None:
-    """Parse an ISO string into a tz-aware (UTC) datetime; allow None."""
+    """
+    Parse an ISO string (summary from/to) into a tz-aware (UTC) datetime; allow None.
+    POST datetimes are parsed by LearningRecordCreateSerializer, not here.
+    """
     if not dt_str:
         return None
-    d = parse_datetime(dt_str)
+    d = parse_datetime(dt_str)  # tries datetime.fromisoformat before its regex
     if d is None:
         raise ValueError("invalid datetime format")
-    if timezone.is_naive(d):
-        d = timezone.make_aware(d, dt.timezone.utc)
-    return d.astimezone(dt.timezone.utc)
+    off = d.utcoffset()
+    if off is None:
+        return d.replace(tzinfo=_UTC)
+    if off == _ZERO:  # already UTC ("Z" / "+00:00"); skip the astimezone copy
+        return d
+    return d.astimezone(_UTC)
 
 
-def _fmt_small_values(val_wc, val_mins):
-    """Small-value replacements (used for totals and averages)."""
-    def wc(v):
-        if v is None:
-            return None
-        v = float(v)
-        return 'word count less than 1' if v < 1.0 else v
+def _iso(d: dt.datetime | None) -> str | None:
+    """ISO-8601 string as DRF's JSONEncoder would render it (UTC as 'Z')."""
+    if d is None:
+        return None
+    s = d.isoformat()
+    return s[:-6] + 'Z' if s.endswith('+00:00') else s
+
+
+def _parse_query_dt(value: str) -> tuple[dt.datetime, str]:
+    """
+    Parse a from/to query value with _to_aware, returning (datetime, repaired string).
+    An unencoded '+' in the UTC offset arrives as a space; that is only repaired
+    (last space -> '+') if the value does not parse as given.
+    """
+    try:
+        return _to_aware(value), value
+    except ValueError:
+        head, sep, tail = value.rpartition(' ')
+        if not sep:
+            raise
+        value = f'{head}+{tail}'
+        return _to_aware(value), value
+
+
+# Summaries are keyed on the user's data version (see _summary_version); the TTL only bounds cache size.
+_SUMMARY_CACHE_TTL = 300
+
+
+def _summary_cache_key(*parts) -> str:
+    """Stable cache key for a summary request (hashed so arbitrary user ids / tz names are key-safe)."""
+    return 'summary:' + hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+
+def _summary_cache_enabled() -> bool:
+    """
+    Summary caching relies on the version bump made by whichever worker handles the POST,
+    so it needs a cache shared across processes; LocMemCache is per process.
+    """
+    return not isinstance(caches['default'], LocMemCache)
+
+
+def _summary_version(user_id: str):
+    """Current data version of a user's records; bumped by every created record."""
+    key = _summary_cache_key('version', user_id)
+    version = cache.get(key)
+    if version is None:
+        # New or evicted counter: start from a fresh value so entries cached under an
+        # earlier counter can never match again.
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def _bump_summary_version(user_id: str) -> None:
+    key = _summary_cache_key('version', user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), None)
+
 
-    def mins(v):
-        if v is None:
-            return None
+_WC_SMALL = 'word count less than 1'
+_MINS_SMALL = 'study minutes less than a minute'
+
+
+def _fmt_wc(v):
+    """Small-value replacement for word counts (totals and averages)."""
+    if v is None:
+        return None
+    if not isinstance(v, float):
         v = float(v)
-        return 'study minutes less than a minute' if v < 1.0 else v
+    return _WC_SMALL if v < 1.0 else v
 
-    return wc(val_wc), mins(val_mins)
+
+def _fmt_mins(v):
+    """Small-value replacement for study minutes (totals and averages)."""
+    if v is None:
+        return None
+    if not isinstance(v, float):
+        v = float(v)
+    return _MINS_SMALL if v < 1.0 else v
 
 
+# The create path is a single upsert statement, so the ATOMIC_REQUESTS BEGIN/COMMIT adds nothing.
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
 class RecordCreateView(APIView):
     """POST /api/records (supports idempotency conflict 409)."""
     def post(self, request):
-        body = request.data or {}
-        user_id = body.get('user_id')
-        word_count = body.get('word_count')
-        idem = request.headers.get('Idempotency-Key') or body.get('idempotency_key')
-        start_at_raw = body.get('start_at')
-        end_at_raw = body.get('end_at')
-
-        if not user_id:
-            return Response({'detail': 'user_id is required.'}, status=400)
-        try:
-            word_count = int(word_count)
-        except (TypeError, ValueError):
-            return Response({'detail': 'word_count must be an integer.'}, status=400)
-        if word_count < 0:
-            return Response({'detail': 'word_count must be >= 0.'}, status=400)
+        serializer = LearningRecordCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        idem = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
         if not idem:
             return Response({'detail': 'Idempotency-Key (header or body) is required.'}, status=400)
 
-        try:
-            start_at = _to_aware(start_at_raw)
-            end_at = _to_aware(end_at_raw)
-        except ValueError as e:
-            return Response({'detail': str(e)}, status=400)
-
+        start_at = data.get('start_at')
+        end_at = data.get('end_at')
         # If both start_at and end_at are missing, default end_at to now (server time).
         if start_at is None and end_at is None:
             end_at = timezone.now()
             if timezone.is_naive(end_at):
-                end_at = timezone.make_aware(end_at, dt.timezone.utc)
-
-        if start_at is not None and end_at is not None and start_at > end_at:
-            return Response({'detail': 'start_at must be <= end_at.'}, status=400)
+                end_at = timezone.make_aware(end_at, _UTC)
 
         try:
-            with transaction.atomic():
-                obj, created = LearningRecord.objects.get_or_create(
-                    user_id=user_id,
-                    idempotency_key=idem,
-                    defaults={
-                        'word_count': word_count,
-                        'start_at': start_at,
-                        'end_at': end_at,
-                    },
-                )
-                if created:
-                    status_code = status.HTTP_201_CREATED
-                else:
-                    # Same idempotency key: accept only if payload is identical; otherwise 409.
-                    same_payload = (
-                        obj.word_count == word_count and
-                        ((obj.start_at == start_at) or (obj.start_at is None and start_at is None)) and
-                        ((obj.end_at == end_at) or (obj.end_at is None and end_at is None))
-                    )
-                    if not same_payload:
-                        return Response(
-                            {'detail': 'Idempotency-Key reused with different payload.'},
-                            status=status.HTTP_409_CONFLICT
-                        )
-                    status_code = status.HTTP_200_OK
-        except IntegrityError:
-            # Handle race: unique constraint hit, re-read and compare payload.
-            obj = LearningRecord.objects.get(user_id=user_id, idempotency_key=idem)
-            same_payload = (
-                obj.word_count == word_count and
-                ((obj.start_at == start_at) or (obj.start_at is None and start_at is None)) and
-                ((obj.end_at == end_at) or (obj.end_at is None and end_at is None))
+            obj, created = upsert_record(
+                user_id=data['user_id'],
+                idempotency_key=idem,
+                word_count=data['word_count'],
+                start_at=start_at,
+                end_at=end_at,
             )
-            if not same_payload:
-                return Response(
-                    {'detail': 'Idempotency-Key reused with different payload.'},
-                    status=status.HTTP_409_CONFLICT
-                )
-            status_code = status.HTTP_200_OK
-
-        # Derived study_minutes returned in POST echo (independent of cross-day bucketing rules).
-        if obj.start_at and obj.end_at:
-            seconds = max(0, int((obj.end_at - obj.start_at).total_seconds()))
+        except IdempotencyConflict as e:
+            return Response({'detail': str(e)}, status=status.HTTP_409_CONFLICT)
+        if created:
+            if _summary_cache_enabled():
+                _bump_summary_version(obj.user_id)
+            status_code = status.HTTP_201_CREATED
         else:
-            seconds = 0
-        study_minutes = seconds // 60
+            status_code = status.HTTP_200_OK
 
         return Response({
             'id': obj.id,
             'user_id': obj.user_id,
             'idempotency_key': idem,
             'word_count': obj.word_count,
-            'start_at': obj.start_at,
-            'end_at': obj.end_at,
-            'created_at': obj.created_at,
-            'study_minutes': study_minutes,
+            'start_at': _iso(obj.start_at),
+            'end_at': _iso(obj.end_at),
+            'created_at': _iso(obj.created_at),
+            # Derived study_minutes returned in POST echo (independent of cross-day bucketing rules).
+            'study_minutes': obj.study_minutes,
         }, status=status_code)
 
 
@@ -160,44 +197,57 @@ class UserSummaryView(APIView):
         if not dt_from or not dt_to:
             return Response({'detail': 'from and to are required (ISO-8601).'}, status=400)
 
-        # Tolerate a space where '+00:00' should be (e.g., when URL query wasn't URL-encoded in tests).
-        if ' ' in dt_from and ('+00:00' not in dt_from) and ('Z' not in dt_from):
-            dt_from = dt_from.replace(' ', '+', 1)
-        if ' ' in dt_to and ('+00:00' not in dt_to) and ('Z' not in dt_to):
-            dt_to = dt_to.replace(' ', '+', 1)
-
-        if gran not in ('hour', 'day', 'month'):
-            return Response({'detail': 'granularity must be hour|day|month.'}, status=400)
         try:
-            pytz.timezone(tzname)
-        except Exception:
+            f, dt_from = _parse_query_dt(dt_from)
+            t, dt_to = _parse_query_dt(dt_to)
+        except ValueError:
+            return Response({'detail': 'from and to must be ISO-8601.'}, status=400)
+        if gran not in GRANULARITIES:
+            return Response({'detail': 'granularity must be hour|day|month.'}, status=400)
+        tz = canonical_tz(tzname)
+        if tz is None:
             return Response({'detail': 'invalid tz.'}, status=400)
-            
+
         if not LearningRecord.objects.filter(user_id=user_id).exists():
             return Response(
                 {"detail": f"user '{user_id}' not found"},
                 status=status.HTTP_404_NOT_FOUND,
             )
 
-        # Still compute per-bucket internally, but do not include buckets in the API response.
-        buckets = summarize_with_sma(user_id, dt_from, dt_to, granularity=gran, tz=tzname)
+        if f >= t:
+            data = self._body(user_id, dt_from, dt_to, gran, tzname, include_empty, 0.0, 0.0, 0.0, 0.0)
+            return Response(data, status=status.HTTP_200_OK)
 
-        wc_total = sum(float(b['wc_sum']) for b in buckets)
-        mins_total = sum(float(b['mins_sum']) for b in buckets)
+        if _summary_cache_enabled():
+            cache_key = _summary_cache_key(
+                user_id, f, t, gran, tz, include_empty, _summary_version(user_id),
+            )
+            # Cache only the numbers: the body echoes from/to as the caller spelled them.
+            numbers = cache.get(cache_key)
+            if numbers is None:
+                numbers = self._summarize(user_id, f, t, gran, tz, include_empty)
+                cache.set(cache_key, numbers, _SUMMARY_CACHE_TTL)
+        else:
+            numbers = self._summarize(user_id, f, t, gran, tz, include_empty)
+        data = self._body(user_id, dt_from, dt_to, gran, tzname, include_empty, *numbers)
+        return Response(data, status=status.HTTP_200_OK)
+
+    def _summarize(self, user_id, f, t, gran, tz, include_empty) -> tuple:
+        """Return (wc_total, mins_total, wc_mean, mins_mean) for [f, t)."""
+        totals = summarize_totals(user_id, f, t, granularity=gran, tz=tz)
+        wc_total = totals['wc_sum']
+        mins_total = totals['mins_sum']
 
         if include_empty:
-            denom = len(buckets) or 1
+            denom = count_buckets(f, t, granularity=gran, tz=tz) or 1
         else:
-            active = [b for b in buckets if (float(b['wc_sum']) > 0.0 or float(b['mins_sum']) > 0.0)]
-            denom = len(active) or 1
+            denom = totals['active_buckets'] or 1
 
-        wc_mean = wc_total / denom
-        mins_mean = mins_total / denom
+        return wc_total, mins_total, wc_total / denom, mins_total / denom
 
-        wc_total_fmt, mins_total_fmt = _fmt_small_values(wc_total, mins_total)
-        wc_mean_fmt, mins_mean_fmt = _fmt_small_values(wc_mean, mins_mean)
-
-        return Response({
+    def _body(self, user_id, dt_from, dt_to, gran, tzname, include_empty,
+              wc_total, mins_total, wc_mean, mins_mean) -> dict:
+        return {
             'user_id': user_id,
             'from': dt_from,
             'to': dt_to,
@@ -205,11 +255,11 @@ class UserSummaryView(APIView):
             'tz': tzname,
             'include_empty': include_empty,
             'totals': {
-                'word_count': wc_total_fmt,
-                'study_minutes': mins_total_fmt,
+                'word_count': _fmt_wc(wc_total),
+                'study_minutes': _fmt_mins(mins_total),
             },
             'averages_per_bucket': {
-                'word_count': wc_mean_fmt,
-                'study_minutes': mins_mean_fmt,
+                'word_count': _fmt_wc(wc_mean),
+                'study_minutes': _fmt_mins(mins_mean),
             },
-        }, status=status.HTTP_200_OK)
+        }